@@ -1,22 +1,27 @@
 """
 Main LiveKit Voice Agent for Usool al-Hadith
 """
+import asyncio
 import logging
 import os
+import re
+from functools import lru_cache
 from dotenv import load_dotenv
 from livekit import agents
 from livekit.agents import (
     Agent,
     AgentSession,
     JobContext,
+    JobProcess,
     WorkerOptions,
     cli,
     llm,
     RoomInputOptions,
 )
-from livekit.plugins import openai, silero
+from livekit.plugins import deepgram, openai, silero
+from openai import AsyncOpenAI
 
-from rag_service import RAGService
+from rag_service import get_rag_service
 from tools import HADITH_TOOLS
 
 # Load environment variables
@@ -26,31 +31,10 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-
-class HadithVoiceAgent:
-    """Voice agent logic for teaching Usool al-Hadith"""
-
-    def __init__(self):
-        """Initialize the agent with RAG service"""
-        self.rag_service = RAGService()
-
-        # Get agent configuration from environment
-        self.agent_name = os.getenv("AGENT_NAME", "Sheikh Abdullah")
-        self.agent_personality = os.getenv(
-            "AGENT_PERSONALITY",
-            "You are a knowledgeable Islamic scholar specializing in Hadith sciences."
-        )
-
-    def create_initial_context(self) -> llm.ChatContext:
-        """
-        Create the initial chat context with system instructions
-
-        Returns:
-            Initial ChatContext for the agent
-        """
-        system_message = f"""You are {self.agent_name}, {self.agent_personality}
-
-Your expertise is in Usool al-Hadith (Foundations of Hadith), which includes:
+# System instructions shared by every session. Everything before the identity
+# line is static so the prefix stays byte-identical across sessions and agents,
+# and long enough (>1024 tokens with the tool schemas) for provider prompt caching.
+_SYSTEM_PROMPT_TMPL = """You are a voice tutor teaching Usool al-Hadith (Foundations of Hadith), which includes:
 - The science of hadith authentication (Ilm al-Rijal)
 - Chain of narration analysis (Isnad)
 - Hadith classifications (Sahih, Hasan, Da'if, etc.)
@@ -60,9 +44,11 @@ Your expertise is in Usool al-Hadith (Foundations of Hadith), which includes:
 You have access to a comprehensive book on Usool al-Hadith. When students ask you questions:
 
 1. **Use your knowledge** for general explanations and teaching
-2. **Search the book** when asked about specific chapters, detailed methodologies, or precise definitions
+2. **Search the book** with the search_usool_book tool only when asked about specific chapters, detailed methodologies, precise definitions, or citations from the book
 3. **Use tools** when asked about specific narrators or classification terms
 
+Do not search the book for greetings, small talk, or general questions you can answer yourself.
+
 Guidelines:
 - Be warm, patient, and encouraging with students
 - Explain complex concepts clearly, using analogies when helpful
@@ -70,16 +56,122 @@ Guidelines:
 - Reference specific chapters or scholars when citing from the book
 - If you're unsure, say so honestly and guide the student to learn together
 
+Terminology reference (use these standard definitions when explaining terms):
+- Hadith (حديث): a report of the sayings, actions, or tacit approvals of the Prophet (peace be upon him)
+- Sunnah (سنة): the normative practice of the Prophet, transmitted through hadith
+- Athar (أثر): a report attributed to a Companion or Successor
+- Isnad (إسناد): the chain of narrators through which a report is transmitted
+- Matn (متن): the text or content of the report that follows the chain
+- Sanad (سند): an individual chain of transmission; often used interchangeably with isnad
+- Sahabi (صحابي): a Companion who met the Prophet as a believer and died as a believer
+- Tabi'i (تابعي): a Successor who met a Companion as a believer
+- Marfu' (مرفوع): a report attributed to the Prophet
+- Mawquf (موقوف): a report attributed to a Companion
+- Maqtu' (مقطوع): a report attributed to a Successor or later
+- Muttasil (متصل): a chain in which every narrator heard from the one above him
+- Mursal (مرسل): a report in which a Successor narrates directly from the Prophet, omitting the Companion
+- Munqati' (منقطع): a chain with a break of one narrator at any point other than the Companion
+- Mu'dal (معضل): a chain with two or more consecutive narrators missing
+- Mu'allaq (معلق): a chain with one or more narrators omitted at its beginning
+- Mudallas (مدلس): a report in which a narrator conceals a defect in the chain, such as a missing teacher
+- Mu'allal (معلل): a report with a hidden defect discovered only by expert scrutiny
+- Shadh (شاذ): a report of a reliable narrator that contradicts more reliable narrators
+- Munkar (منكر): a report of a weak narrator that contradicts reliable narrators
+- Mudraj (مدرج): a report into which a narrator's words were inserted
+- Mutawatir (متواتر): a report narrated by so many at every level that collusion on falsehood is impossible
+- Ahad (آحاد): any report that does not reach the level of mutawatir
+- Gharib (غريب): a report with a single narrator at some level of the chain
+- 'Aziz (عزيز): a report with no fewer than two narrators at every level
+- Mashhur (مشهور): a report with three or more narrators at every level, short of mutawatir
+- 'Adalah (عدالة): the moral integrity and religious uprightness of a narrator
+- Dabt (ضبط): the precision of a narrator's memory or written record
+- Thiqah (ثقة): a narrator combining 'adalah and dabt, whose reports are accepted
+- Jarh wa Ta'dil (الجرح والتعديل): the discipline of criticizing and accrediting narrators
+- Mustalah al-Hadith (مصطلح الحديث): the technical terminology of hadith sciences
+
 Remember: Your goal is to make the intricate science of Hadith methodology accessible and engaging for students of all levels.
+
+Your identity: You are {name}, {personality}
 """
 
-        # Create ChatContext with system message using add_message
-        ctx = llm.ChatContext()
-        ctx.add_message(
-            role="system",
-            content=system_message
+# Instructions for the SUMMARY_MODE=llm summarizer
+_SUMMARY_INSTRUCTIONS = """You are helping a voice agent answer questions about Usool al-Hadith.
+
+You will be given context retrieved from the book and a user question. Your task:
+1. If the context contains relevant information, extract and summarize it concisely (2-3 sentences max)
+2. If the context is NOT relevant or doesn't answer the question, respond with: "NO_RELEVANT_INFO"
+3. Include key Arabic terms if relevant
+4. Cite page numbers if mentioned in the context
+
+This will be spoken aloud, so keep it brief and natural."""
+
+# Greetings, confirmations and conversational requests that never need a book lookup
+_SKIP_RE = re.compile(
+    r"\b(hello|hi|thanks|thank you|bye|goodbye|yes|ok|okay|repeat|again|continue)\b",
+    re.I,
+)
+# "No" and "name" are only small talk on their own; inside a sentence they usually
+# belong to a real question ("No, explain hasan", "Name of Abu Hurairah's teacher")
+_BARE_RE = re.compile(r"^\W*(no|nope|name|your name|what(?:'s| is) your name)\W*$", re.I)
+# Requests to teach something are book questions even after a skip word ("Okay, define mursal")
+_TEACH_RE = re.compile(
+    r"\b(explain|define|describe|tell me about|compare|what about|what is|what are|who is|who was)\b",
+    re.I,
+)
+# Utterances shorter than this (in characters or words) are never book questions
+_MIN_QUESTION_CHARS = 8
+_MIN_QUESTION_WORDS = 2
+
+
+@lru_cache(maxsize=256)
+def _is_small_talk(question: str) -> bool:
+    """Check whether an utterance is too short or a greeting, confirmation or pleasantry"""
+    question = question.strip()
+    if _BARE_RE.match(question):
+        return True
+    # Explicit questions are never small talk, however short ("Mursal?")
+    if question.endswith("?"):
+        return False
+    word_count = len(question.split())
+    if len(question) < _MIN_QUESTION_CHARS or word_count < _MIN_QUESTION_WORDS:
+        return True
+    if _TEACH_RE.search(question):
+        return False
+    return bool(_SKIP_RE.search(question)) and word_count < 5
+
+
+class HadithVoiceAgent:
+    """Voice agent logic for teaching Usool al-Hadith"""
+
+    def __init__(self):
+        """Initialize the agent with RAG service"""
+        # Shared with the search_usool_book tool so the model is only loaded once
+        self.rag_service = get_rag_service()
+
+        # "tool" lets the LLM search the book on demand; "eager" retrieves on every turn
+        self.rag_mode = os.getenv("RAG_MODE", "tool").lower()
+        # Seconds eager RAG may delay the reply before it is discarded for this turn
+        self.rag_timeout = float(os.getenv("RAG_EAGER_TIMEOUT", "1.0"))
+
+        # "extractive" summarizes locally with embeddings; "llm" streams from SUMMARY_LLM_MODEL
+        self.summary_mode = os.getenv("SUMMARY_MODE", "extractive").lower()
+        self.summary_sentences = int(os.getenv("SUMMARY_SENTENCES", "3"))
+        # Not a relevance gate by default: e5 scores even unrelated sentences highly,
+        # so only set a floor after calibrating it on real questions
+        self.summary_min_similarity = float(os.getenv("SUMMARY_MIN_SIMILARITY", "0.0"))
+        # Any OpenAI-compatible endpoint, e.g. https://api.groq.com/openai/v1 for low TTFT
+        self.summary_model = os.getenv("SUMMARY_LLM_MODEL", "gpt-4o-mini")
+        self.summary_client = AsyncOpenAI(
+            api_key=os.getenv("SUMMARY_LLM_API_KEY") or os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("SUMMARY_LLM_BASE_URL") or None,
+        )
+
+        # Get agent configuration from environment
+        self.agent_name = os.getenv("AGENT_NAME", "Sheikh Abdullah")
+        self.agent_personality = os.getenv(
+            "AGENT_PERSONALITY",
+            "You are a knowledgeable Islamic scholar specializing in Hadith sciences."
         )
-        return ctx
 
     def should_use_rag(self, question: str) -> bool:
         """
@@ -92,9 +184,8 @@ Remember: Your goal is to make the intricate science of Hadith methodology acces
         Returns:
             True if RAG should be used (almost always True)
         """
-        # Skip RAG for greetings and very short questions
-        skip_keywords = ["hello", "hi", "thanks", "thank you", "bye", "goodbye"]
-        if any(keyword in question.lower() for keyword in skip_keywords) and len(question.split()) < 5:
+        # Skip RAG for greetings, confirmations and very short questions
+        if _is_small_talk(question):
             return False
 
         # Always use RAG for substantive questions
@@ -115,7 +206,8 @@ Remember: Your goal is to make the intricate science of Hadith methodology acces
         logger.info(f"RAG query detected for: {question}")
 
         # Retrieve context from the book
-        context = self.rag_service.query(question)
+        documents = await self.rag_service.aretrieve_context(question)
+        context = self.rag_service.format_context(documents)
 
         # Log the raw RAG results
         logger.info("=" * 80)
@@ -124,36 +216,18 @@ Remember: Your goal is to make the intricate science of Hadith methodology acces
         logger.info(context)
         logger.info("=" * 80)
 
-        # Summarize the context using OpenAI for concise voice output
-        from openai import OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-        summary_prompt = f"""You are helping a voice agent answer questions about Usool al-Hadith.
-
-Retrieved context from the book:
-{context}
-
-User question: {question}
-
-Your task:
-1. If the context contains relevant information, extract and summarize it concisely (2-3 sentences max)
-2. If the context is NOT relevant or doesn't answer the question, respond with: "NO_RELEVANT_INFO"
-3. Include key Arabic terms if relevant
-4. Cite page numbers if mentioned in the context
-
-This will be spoken aloud, so keep it brief and natural.
-
-Response:"""
-
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # Fast and cheap for summarization
-                messages=[{"role": "user", "content": summary_prompt}],
-                max_tokens=200,  # Keep it short for voice
-                temperature=0.3,  # Lower temperature for factual accuracy
-            )
-
-            summarized_context = response.choices[0].message.content.strip()
+            if self.summary_mode == "llm":
+                summarized_context = await self.summarize_with_llm(question, context)
+            else:
+                # Extractive summary: top sentences by similarity, no network call
+                summarized_context = await asyncio.to_thread(
+                    self.rag_service.summarize,
+                    question,
+                    documents,
+                    max_sentences=self.summary_sentences,
+                    min_similarity=self.summary_min_similarity,
+                ) or "NO_RELEVANT_INFO"
 
             # Log the summarized result
             logger.info("-" * 80)
@@ -182,36 +256,57 @@ Response:"""
                 f"Based on the above content, please answer briefly: {question}"
             )
 
+    async def summarize_with_llm(self, question: str, context: str) -> str:
+        """
+        Summarize retrieved context with a streaming LLM call
 
-class HadithAssistant(Agent):
-    """Modern Agent wrapper for Hadith teaching"""
+        Args:
+            question: User's question
+            context: Formatted context retrieved from the book
 
-    def __init__(self, hadith_agent: HadithVoiceAgent):
-        # Get the system message for instructions
-        system_message = f"""You are {hadith_agent.agent_name}, {hadith_agent.agent_personality}
+        Returns:
+            Summary text, or "NO_RELEVANT_INFO" if the context is not relevant
+        """
+        # Only the context and question vary; the instructions live in a static
+        # system message so providers can serve that prefix from their prompt cache
+        user_prompt = f"""Retrieved context from the book:
+{context}
 
-Your expertise is in Usool al-Hadith (Foundations of Hadith), which includes:
-- The science of hadith authentication (Ilm al-Rijal)
-- Chain of narration analysis (Isnad)
-- Hadith classifications (Sahih, Hasan, Da'if, etc.)
-- Narrator criticism and reliability
-- Hadith terminology in both Arabic and English
+User question: {question}"""
+
+        stream = await self.summary_client.chat.completions.create(
+            model=self.summary_model,  # Fast and cheap for summarization
+            messages=[
+                {"role": "system", "content": _SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": user_prompt},
+            ],
+            max_tokens=200,  # Keep it short for voice
+            temperature=0.3,  # Lower temperature for factual accuracy
+            stream=True,
+        )
 
-You have access to a comprehensive book on Usool al-Hadith. When students ask you questions:
+        chunks = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            chunks.append(chunk.choices[0].delta.content or "")
+            # Stop paying for tokens as soon as the model says nothing is relevant
+            if "".join(chunks).lstrip().startswith("NO_RELEVANT_INFO"):
+                await stream.close()
+                break
 
-1. **Use your knowledge** for general explanations and teaching
-2. **Search the book** when asked about specific chapters, detailed methodologies, or precise definitions
-3. **Use tools** when asked about specific narrators or classification terms
+        return "".join(chunks).strip()
 
-Guidelines:
-- Be warm, patient, and encouraging with students
-- Explain complex concepts clearly, using analogies when helpful
-- Include relevant Arabic terms with English translations
-- Reference specific chapters or scholars when citing from the book
-- If you're unsure, say so honestly and guide the student to learn together
 
-Remember: Your goal is to make the intricate science of Hadith methodology accessible and engaging for students of all levels.
-"""
+class HadithAssistant(Agent):
+    """Modern Agent wrapper for Hadith teaching"""
+
+    def __init__(self, hadith_agent: HadithVoiceAgent):
+        # Get the system message for instructions
+        system_message = _SYSTEM_PROMPT_TMPL.format(
+            name=hadith_agent.agent_name,
+            personality=hadith_agent.agent_personality,
+        )
 
         super().__init__(
             instructions=system_message,
@@ -227,45 +322,71 @@ Remember: Your goal is to make the intricate science of Hadith methodology acces
     ) -> None:
         """
         Hook that runs each time the user finishes speaking.
-        We plug in RAG logic here.
+        RAG is injected here only when RAG_MODE=eager; otherwise the
+        LLM searches the book on demand via the search_usool_book tool.
 
         Args:
             turn_ctx: Current conversation context
             new_message: User's message
         """
-        logger.info(f"🎤 on_user_turn_completed called! Role: {new_message.role}")
-
         if new_message.role != "user":
-            logger.info(f"   Skipping - not a user message")
             return
 
-        # Safely get the question text
-        question = (
-            new_message.content
-            if isinstance(new_message.content, str)
-            else str(new_message.content)
-        )
+        # text_content joins the message's text parts (None if it has none)
+        question = new_message.text_content or ""
+        if not question:
+            return
+
+        # Gate before any logging so skipped turns cost a memoized regex check
+        if self.hadith_agent.rag_mode != "eager":
+            # The LLM calls search_usool_book itself when it needs the book
+            logger.debug(f"📝 User question: {question}")
+            return
+        if not self.hadith_agent.should_use_rag(question):
+            logger.debug(f"❌ RAG skipped - greeting/short question: {question}")
+            return
 
         logger.info(f"📝 User question: {question}")
+        logger.info(f"✅ RAG triggered for question!")
+        # Retrieval and summarization run off the event loop; if they miss the
+        # deadline the reply starts without them. Cancelling the task stops any
+        # summary still in flight (no paying for an LLM summary nobody reads),
+        # while the retrieval thread runs to completion and fills the cache
+        rag_task = asyncio.create_task(self.hadith_agent.enhance_with_rag(question))
+        done, _ = await asyncio.wait({rag_task}, timeout=self.hadith_agent.rag_timeout)
+        if not done:
+            logger.info(f"⏱️ RAG exceeded {self.hadith_agent.rag_timeout}s - answering without it")
+            rag_task.cancel()
+            return
 
-        # Check if we should enhance with RAG
-        if self.hadith_agent.should_use_rag(question):
-            logger.info(f"✅ RAG triggered for question!")
-            # Get RAG-enhanced context (now async for summarization)
-            enhanced_message = await self.hadith_agent.enhance_with_rag(question)
-
-            # Only inject RAG if it returned relevant info
-            if enhanced_message:
-                logger.info(f"💡 Injecting RAG context into conversation")
-                # Add assistant message with RAG context using add_message
-                turn_ctx.add_message(
-                    role="assistant",
-                    content=enhanced_message
-                )
-            else:
-                logger.info(f"💭 No RAG context injected - agent will use its own knowledge")
+        enhanced_message = rag_task.result()
+
+        # Only inject RAG if it returned relevant info
+        if enhanced_message:
+            logger.info(f"💡 Injecting RAG context into conversation")
+            # Add assistant message with RAG context using add_message
+            turn_ctx.add_message(
+                role="assistant",
+                content=enhanced_message
+            )
         else:
-            logger.info(f"❌ RAG skipped - greeting/short question")
+            logger.info(f"💭 No RAG context injected - agent will use its own knowledge")
+
+
+def prewarm(proc: JobProcess):
+    """
+    Load the embedding model and prime retrieval when the worker process starts,
+    so the first question does not pay for model loading and Pinecone setup
+
+    Args:
+        proc: Job process from LiveKit
+    """
+    logger.info("Warming up RAG service...")
+    try:
+        get_rag_service().warm_up()
+        logger.info("RAG service warm")
+    except Exception as e:
+        logger.error(f"RAG warm-up failed: {e}")
 
 
 async def entrypoint(ctx: JobContext):
@@ -287,16 +408,27 @@ async def entrypoint(ctx: JobContext):
     model = os.getenv("LLM_MODEL", "gpt-4o")
     tts_voice = os.getenv("TTS_VOICE", "alloy")
     tts_model = os.getenv("TTS_MODEL", "tts-1")
-    stt_model = os.getenv("STT_MODEL", "whisper-1")
+    stt_provider = os.getenv("STT_PROVIDER", "openai").lower()
+
+    # Deepgram streams transcripts while the user speaks; Whisper transcribes after VAD end
+    if stt_provider == "deepgram":
+        stt = deepgram.STT(model=os.getenv("DEEPGRAM_STT_MODEL", "nova-2"))
+    else:
+        stt = openai.STT(model=os.getenv("STT_MODEL", "whisper-1"))
 
     # Build LLM config - temperature is optional for newer models
     llm_kwargs = {"model": model}
     if os.getenv("LLM_TEMPERATURE"):
         llm_kwargs["temperature"] = float(os.getenv("LLM_TEMPERATURE"))
+    # Optional OpenAI-compatible provider (Groq, Together, ...) for the main LLM
+    if os.getenv("LLM_BASE_URL"):
+        llm_kwargs["base_url"] = os.getenv("LLM_BASE_URL")
+    if os.getenv("LLM_API_KEY"):
+        llm_kwargs["api_key"] = os.getenv("LLM_API_KEY")
 
     # Create AgentSession with voice pipeline
     session = AgentSession(
-        stt=openai.STT(model=stt_model),
+        stt=stt,
         llm=openai.LLM(**llm_kwargs),
         tts=openai.TTS(model=tts_model, voice=tts_voice),
         vad=silero.VAD.load(),
@@ -330,5 +462,9 @@ if __name__ == "__main__":
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
+            prewarm_fnc=prewarm,
+            # prewarm loads the embedding model and queries Pinecone, which can take
+            # far longer than LiveKit's 10s default on CPU or on first model download
+            initialize_process_timeout=float(os.getenv("PREWARM_TIMEOUT", "120")),
         )
     )
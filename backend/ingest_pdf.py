@@ -2,48 +2,91 @@
 PDF Ingestion Script for Usool al-Hadith
 Processes the PDF and uploads embeddings to Pinecone
 """
+import hashlib
 import os
+import re
+import unicodedata
+import torch
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_pinecone import PineconeVectorStore
 from pinecone import Pinecone, ServerlessSpec
+from transformers import AutoTokenizer
+
+from rag_service import EMBEDDING_MODEL, load_embeddings
 
 load_dotenv()
 
-# Use local embeddings (free) instead of OpenAI
-EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
-EMBEDDING_DIMENSION = 1024  # Dimension for multilingual-e5-large
+# Chunks below these thresholds are PDF artifacts (page numbers, headers, stray symbols)
+MIN_CHUNK_ALNUM_CHARS = 30
+MIN_CHUNK_LETTER_RATIO = 0.5
 
-def ingest_pdf(pdf_path: str):
+# Tokens kept free below the model's max input length for [CLS]/[SEP]-style markers
+CHUNK_TOKEN_MARGIN = 16
+
+
+def _is_useful(text: str) -> bool:
     """
-    Ingest PDF into Pinecone vector database
+    Check whether a chunk has enough real text to be worth indexing
 
     Args:
-        pdf_path: Path to the PDF file
+        text: Chunk content
+
+    Returns:
+        True if the chunk should be indexed
     """
-    print(f"Loading PDF from {pdf_path}...")
+    if len(re.sub(r"\W+", "", text)) < MIN_CHUNK_ALNUM_CHARS:
+        return False
+    # Count combining marks as letters so vowelled Arabic (harakat) is not
+    # mistaken for noise, and ignore whitespace in the denominator
+    chars = [ch for ch in text if not ch.isspace()]
+    letters = sum(unicodedata.category(ch)[0] in "LM" for ch in chars)
+    return letters / max(len(chars), 1) > MIN_CHUNK_LETTER_RATIO
 
-    # Load PDF
-    loader = PyPDFLoader(pdf_path)
-    documents = loader.load()
 
-    print(f"Loaded {len(documents)} pages from PDF")
+def _content_hash(text: str) -> bytes:
+    """Hash a chunk's whitespace- and case-normalized text for deduplication"""
+    normalized = " ".join(text.casefold().split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
 
-    # Split documents into chunks
-    chunk_size = int(os.getenv("CHUNK_SIZE", "1000"))
-    chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "200"))
 
-    text_splitter = RecursiveCharacterTextSplitter(
+def ingest_pdf(pdf_path: str):
+    """
+    Ingest PDF into Pinecone vector database
+
+    Args:
+        pdf_path: Path to the PDF file
+    """
+    # Split documents into chunks measured in embedding-model tokens, kept
+    # under e5's 512-token limit so no chunk is silently truncated
+    # CHUNK_TOKENS/CHUNK_OVERLAP_TOKENS replace the old character-based
+    # CHUNK_SIZE/CHUNK_OVERLAP so stale .env values are not read as tokens
+    chunk_size = int(os.getenv("CHUNK_TOKENS", "450"))
+    chunk_overlap = int(os.getenv("CHUNK_OVERLAP_TOKENS", "60"))
+
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    # Leave room for the special tokens the model adds to every input
+    max_chunk_size = tokenizer.model_max_length - CHUNK_TOKEN_MARGIN
+    if chunk_size > max_chunk_size:
+        print(f"CHUNK_TOKENS={chunk_size} exceeds the model limit, using {max_chunk_size}")
+        chunk_size = max_chunk_size
+        chunk_overlap = min(chunk_overlap, chunk_size // 4)
+    text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
-        length_function=len,
         separators=["\n\n", "\n", " ", ""]
     )
 
-    chunks = text_splitter.split_documents(documents)
-    print(f"Split into {len(chunks)} chunks")
+    # Initialize embeddings (FREE - runs locally!)
+    # Large batches keep the GPU busy and amortize per-batch overhead on CPU
+    print(f"Loading embedding model: {EMBEDDING_MODEL}")
+    if not torch.cuda.is_available():
+        # Ingestion is a one-off batch job, so let it use every core
+        torch.set_num_threads(os.cpu_count())
+    embeddings = load_embeddings(batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "128")))
+    embedding_dimension = len(embeddings.embed_query("dimension probe"))
 
     # Initialize Pinecone
     pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
@@ -56,8 +99,10 @@ def ingest_pdf(pdf_path: str):
         print(f"Creating new Pinecone index: {index_name}")
         pc.create_index(
             name=index_name,
-            dimension=EMBEDDING_DIMENSION,  # Using local model dimension
-            metric="cosine",
+            dimension=embedding_dimension,  # Using local model dimension
+            # Embeddings are L2-normalized, so dot product ranks like cosine
+            # without the per-query normalization
+            metric=os.getenv("PINECONE_METRIC", "dotproduct"),
             spec=ServerlessSpec(
                 cloud="aws",
                 region=os.getenv("PINECONE_ENVIRONMENT", "us-east-1")
@@ -66,24 +111,47 @@ def ingest_pdf(pdf_path: str):
     else:
         print(f"Using existing Pinecone index: {index_name}")
 
-    # Initialize embeddings (FREE - runs locally!)
-    print(f"Loading embedding model: {EMBEDDING_MODEL}")
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
+    vector_store = PineconeVectorStore(
+        index_name=index_name,
+        embedding=embeddings
     )
 
-    # Upload to Pinecone
+    # Stream pages through the splitter and upload chunks in batches, so peak
+    # memory stays at one batch instead of the whole book
+    print(f"Loading PDF from {pdf_path}...")
     print("Uploading embeddings to Pinecone...")
-    vector_store = PineconeVectorStore.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        index_name=index_name
-    )
+    loader = PyPDFLoader(pdf_path)
+    ingest_batch_size = int(os.getenv("INGEST_BATCH_SIZE", "200"))
+    upsert_batch_size = int(os.getenv("UPSERT_BATCH_SIZE", "200"))
+
+    buffer = []
+    seen_hashes = set()
+    page_count = 0
+    chunk_count = 0
+    skipped_count = 0
+    for page in loader.lazy_load():
+        page_count += 1
+        for chunk in text_splitter.split_documents([page]):
+            # Drop garbage and repeated chunks (running headers, duplicated pages)
+            digest = _content_hash(chunk.page_content)
+            if digest in seen_hashes or not _is_useful(chunk.page_content):
+                skipped_count += 1
+                continue
+            seen_hashes.add(digest)
+            buffer.append(chunk)
+        if len(buffer) >= ingest_batch_size:
+            vector_store.add_documents(buffer, batch_size=upsert_batch_size)
+            chunk_count += len(buffer)
+            print(f"  Uploaded {chunk_count} chunks ({page_count} pages processed)")
+            buffer.clear()
+
+    if buffer:
+        vector_store.add_documents(buffer, batch_size=upsert_batch_size)
+        chunk_count += len(buffer)
 
     print("✓ PDF ingestion complete!")
-    print(f"✓ {len(chunks)} chunks uploaded to Pinecone index '{index_name}'")
+    print(f"✓ Skipped {skipped_count} tiny, garbage or duplicate chunks")
+    print(f"✓ {chunk_count} chunks from {page_count} pages uploaded to Pinecone index '{index_name}'")
 
     return vector_store
 
@@ -1,8 +1,15 @@
 """
 RAG Service for retrieving information from Usool al-Hadith
 """
+import asyncio
 import os
-from typing import List
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 from dotenv import load_dotenv
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_pinecone import PineconeVectorStore
@@ -10,21 +17,216 @@ from langchain_core.documents import Document
 
 load_dotenv()
 
+# Common questions retrieved at startup to prime the model, Pinecone connection and cache
+WARM_UP_QUERIES = [
+    "usool hadith overview",
+    "sahih hadith definition",
+    "chain of narration",
+    "hasan and da'if hadith",
+    "narrator criticism jarh wa ta'dil",
+]
+
+# Sentence boundaries for extractive summaries (end punctuation or line breaks)
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?؟])\s+|\n{2,}")
+_MIN_SENTENCE_CHARS = 20
+
+# Shared with ingest_pdf.py: the index must be built with the same model it is queried with.
+# intfloat/multilingual-e5-small (384-dim) is 3-5x faster on CPU but needs its own index.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "intfloat/multilingual-e5-large")
+
+
+def load_embeddings(**encode_kwargs) -> HuggingFaceEmbeddings:
+    """
+    Load the local embedding model on the fastest available device
+
+    EMBEDDING_DEVICE defaults to CUDA when available. EMBEDDING_BACKEND=onnx
+    runs the model through ONNX Runtime (requires optimum[onnxruntime]);
+    EMBEDDING_ONNX_FILE selects a quantized export such as
+    onnx/model_qint8_avx512_vnni.onnx.
+
+    Args:
+        **encode_kwargs: Extra arguments for SentenceTransformer.encode
+
+    Returns:
+        Embeddings producing L2-normalized vectors
+    """
+    device = os.getenv("EMBEDDING_DEVICE")
+    if not device:
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    model_kwargs = {"device": device}
+    backend = os.getenv("EMBEDDING_BACKEND", "torch")
+    if backend != "torch":
+        model_kwargs["backend"] = backend
+        if os.getenv("EMBEDDING_ONNX_FILE"):
+            model_kwargs["model_kwargs"] = {"file_name": os.getenv("EMBEDDING_ONNX_FILE")}
+
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"normalize_embeddings": True, **encode_kwargs},
+    )
+
+
+class SemanticCache:
+    """
+    In-memory cache of retrieval results keyed by query text and embedding
+
+    Repeats of a question (same words after case/whitespace normalization)
+    hit an exact-text key. Near-duplicate queries (paraphrases) are found
+    with random-projection LSH: each of the L tables hashes a vector to the
+    sign pattern of its projection onto k random +/-1 planes. Candidates
+    from the matching buckets are then checked with an exact cosine
+    similarity. e5 similarities cluster high, so similarity matching is
+    off unless the threshold is set below 1.0.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 1.0,
+        max_entries: int = 1024,
+        num_tables: int = 4,
+        num_planes: int = 12,
+        seed: int = 0,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.num_tables = num_tables
+        self.num_planes = num_planes
+        self._rng = np.random.default_rng(seed)
+        # Created lazily once the embedding dimension is known
+        self._planes: Optional[np.ndarray] = None
+        self.signatures: List[Dict[Tuple[int, ...], List[int]]] = [
+            {} for _ in range(num_tables)
+        ]
+        # normalized query text -> entry id
+        self._exact: Dict[str, int] = {}
+        # entry id -> (normalized vector, k, documents, bucket keys, text), in LRU order
+        self._entries: OrderedDict = OrderedDict()
+        self._next_id = 0
+        # Retrieval runs in worker threads, so lookups and inserts must not interleave
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        """Normalize query text for exact matching"""
+        return " ".join(query.casefold().split()).rstrip("?.! ")
+
+    def _keys(self, vector: np.ndarray) -> List[Tuple[int, ...]]:
+        """Compute the bucket key of a vector in every hash table"""
+        if self._planes is None:
+            self._planes = self._rng.choice(
+                [-1.0, 1.0],
+                size=(self.num_tables, vector.shape[0], self.num_planes),
+            ).astype(np.float32)
+        bits = np.einsum("d,tdp->tp", vector, self._planes) > 0
+        return [tuple(row) for row in bits.astype(np.int8).tolist()]
+
+    def get_exact(self, query: str, k: int) -> Optional[List[Document]]:
+        """
+        Look up documents cached for the same question text
+
+        Args:
+            query: The user's question
+            k: Number of documents required
+
+        Returns:
+            Cached documents on a hit, otherwise None
+        """
+        with self._lock:
+            entry_id = self._exact.get(self._normalize(query))
+            if entry_id is None or self._entries[entry_id][1] < k:
+                return None
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id][2][:k]
+
+    def get(self, vector: np.ndarray, k: int) -> Optional[List[Document]]:
+        """
+        Look up documents cached for a near-identical query
+
+        Args:
+            vector: Normalized query embedding
+            k: Number of documents required
+
+        Returns:
+            Cached documents on a hit, otherwise None
+        """
+        with self._lock:
+            return self._get(vector, k)
+
+    def _get(self, vector: np.ndarray, k: int) -> Optional[List[Document]]:
+        """Look up a cached entry; the caller must hold the lock"""
+        if self.threshold >= 1.0 or not self._entries:
+            return None
+
+        candidate_ids = set()
+        for table, key in zip(self.signatures, self._keys(vector)):
+            candidate_ids.update(table.get(key, ()))
+        candidate_ids = [i for i in candidate_ids if self._entries[i][1] >= k]
+        if not candidate_ids:
+            return None
+
+        matrix = np.stack([self._entries[i][0] for i in candidate_ids])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+
+        entry_id = candidate_ids[best]
+        self._entries.move_to_end(entry_id)
+        return self._entries[entry_id][2][:k]
+
+    def put(self, query: str, vector: np.ndarray, k: int, documents: List[Document]) -> None:
+        """
+        Cache the documents retrieved for a query
+
+        Args:
+            query: The user's question
+            vector: Normalized query embedding
+            k: Number of documents that were requested
+            documents: Retrieved documents
+        """
+        with self._lock:
+            text = self._normalize(query)
+            previous = self._exact.get(text)
+            if previous is not None:
+                self._remove(previous)
+
+            keys = self._keys(vector)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (vector, k, documents, keys, text)
+            self._exact[text] = entry_id
+            for table, key in zip(self.signatures, keys):
+                table.setdefault(key, []).append(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        """Drop an entry from the LRU order, the exact-text key and the LSH tables"""
+        _, _, _, keys, text = self._entries.pop(entry_id)
+        if self._exact.get(text) == entry_id:
+            del self._exact[text]
+        for table, key in zip(self.signatures, keys):
+            bucket = table[key]
+            bucket.remove(entry_id)
+            if not bucket:
+                del table[key]
+
+
 class RAGService:
     """Service for retrieving relevant information from the Hadith book"""
 
     def __init__(self):
         """Initialize RAG service with Pinecone vector store"""
         # Use local embeddings (FREE - no API costs!)
-        # multilingual-e5-large: Great for Arabic + English text
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="intfloat/multilingual-e5-large",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # multilingual-e5: Great for Arabic + English text
+        self.embeddings = load_embeddings()
 
         self.index_name = os.getenv("PINECONE_INDEX_NAME", "usool-hadith-index")
-        self.top_k = int(os.getenv("TOP_K_RESULTS", "5"))
+        self.top_k = int(os.getenv("TOP_K_RESULTS", "3"))
 
         # Initialize vector store
         self.vector_store = PineconeVectorStore(
@@ -32,6 +234,18 @@ class RAGService:
             embedding=self.embeddings
         )
 
+        # Repeated questions skip the Pinecone round-trip. Rephrasings hit too once
+        # CACHE_SIM_THRESHOLD is lowered below 1.0 (calibrate it for the model first)
+        self.cache = SemanticCache(
+            threshold=float(os.getenv("CACHE_SIM_THRESHOLD", "1.0")),
+            max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+        )
+
+        # Memoize embeddings: the same query is embedded for retrieval and
+        # summarization, and the same chunks come back across questions
+        self._embed_query = lru_cache(maxsize=256)(self.embeddings.embed_query)
+        self._embed_sentences = lru_cache(maxsize=512)(self._embed_sentences_uncached)
+
     def retrieve_context(self, query: str, k: int = None) -> List[Document]:
         """
         Retrieve relevant context from the vector store
@@ -46,13 +260,40 @@ class RAGService:
         if k is None:
             k = self.top_k
 
-        results = self.vector_store.similarity_search(
-            query=query,
+        # Exact repeats skip even the embedding
+        cached = self.cache.get_exact(query, k)
+        if cached is not None:
+            return cached
+
+        # Embed once and reuse the vector for both the cache probe and Pinecone
+        embedding = self._embed_query(query)
+        vector = np.asarray(embedding, dtype=np.float32)
+
+        cached = self.cache.get(vector, k)
+        if cached is not None:
+            return cached
+
+        results = self.vector_store.similarity_search_by_vector(
+            embedding=embedding,
             k=k
         )
 
+        self.cache.put(query, vector, k, results)
         return results
 
+    async def aretrieve_context(self, query: str, k: int = None) -> List[Document]:
+        """
+        Retrieve relevant context without blocking the event loop
+
+        Args:
+            query: The user's question
+            k: Number of results to retrieve (defaults to TOP_K_RESULTS from env)
+
+        Returns:
+            List of relevant documents
+        """
+        return await asyncio.to_thread(self.retrieve_context, query, k)
+
     def format_context(self, documents: List[Document]) -> str:
         """
         Format retrieved documents into a context string
@@ -76,6 +317,76 @@ class RAGService:
 
         return "\n\n".join(context_parts)
 
+    def _embed_sentences_uncached(self, text: str) -> Tuple[List[str], Optional[np.ndarray]]:
+        """Split a chunk into sentences and embed them in one batch"""
+        sentences = [
+            " ".join(part.split())
+            for part in _SENTENCE_SPLIT_RE.split(text)
+            if len(part.strip()) >= _MIN_SENTENCE_CHARS
+        ]
+        if not sentences:
+            return [], None
+        vectors = np.asarray(self.embeddings.embed_documents(sentences), dtype=np.float32)
+        return sentences, vectors
+
+    def summarize(
+        self,
+        question: str,
+        documents: List[Document],
+        max_sentences: int = 3,
+        min_similarity: float = 0.0,
+    ) -> Optional[str]:
+        """
+        Build an extractive summary of retrieved documents
+
+        Keeps the sentences most similar to the question, in reading order,
+        so no extra LLM call is needed to shorten the context for voice.
+
+        Args:
+            question: The user's question
+            documents: Retrieved documents
+            max_sentences: Maximum number of sentences to keep
+            min_similarity: Minimum cosine similarity of the best sentence
+
+        Returns:
+            Summary with page references, or None if nothing is relevant enough
+        """
+        query_vector = np.asarray(self._embed_query(question), dtype=np.float32)
+
+        # (score, doc index, sentence index, sentence, page) for every sentence
+        candidates = []
+        for doc_index, doc in enumerate(documents):
+            sentences, vectors = self._embed_sentences(doc.page_content)
+            if vectors is None:
+                continue
+            scores = vectors @ query_vector
+            page_num = doc.metadata.get('page', 'Unknown')
+            for sentence_index, (sentence, score) in enumerate(zip(sentences, scores)):
+                candidates.append((float(score), doc_index, sentence_index, sentence, page_num))
+
+        if not candidates:
+            return None
+
+        top = sorted(candidates, key=lambda c: c[0], reverse=True)[:max_sentences]
+        if top[0][0] < min_similarity:
+            return None
+
+        top.sort(key=lambda c: (c[1], c[2]))
+        return " ".join(f"{sentence} (page {page_num})" for _, _, _, sentence, page_num in top)
+
+    def warm_up(self, queries: List[str] = WARM_UP_QUERIES) -> None:
+        """
+        Run retrieval for common questions so the first user query is fast
+
+        Loads lazy model state, opens the connection to Pinecone and
+        populates the semantic cache.
+
+        Args:
+            queries: Questions to retrieve
+        """
+        for question in queries:
+            self.retrieve_context(question)
+
     def query(self, question: str) -> str:
         """
         Query the RAG system and return formatted context
@@ -88,3 +399,35 @@ class RAGService:
         """
         documents = self.retrieve_context(question)
         return self.format_context(documents)
+
+    async def aquery(self, question: str) -> str:
+        """
+        Query the RAG system without blocking the event loop
+
+        Embedding and the Pinecone request run in a worker thread so audio
+        frames keep flowing while the book is searched.
+
+        Args:
+            question: The user's question
+
+        Returns:
+            Formatted context string
+        """
+        documents = await self.aretrieve_context(question)
+        return self.format_context(documents)
+
+
+_rag_service: Optional[RAGService] = None
+
+
+def get_rag_service() -> RAGService:
+    """
+    Get the process-wide RAG service, creating it on first use
+
+    Returns:
+        Shared RAGService instance
+    """
+    global _rag_service
+    if _rag_service is None:
+        _rag_service = RAGService()
+    return _rag_service
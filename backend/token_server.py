@@ -3,9 +3,11 @@ Token Server for LiveKit
 Generates access tokens for frontend clients
 """
 import os
+import secrets
 from dotenv import load_dotenv
 from aiohttp import web
 from livekit import api
+from multidict import CIMultiDict
 import logging
 
 load_dotenv()
@@ -13,6 +15,18 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Read once at startup instead of on every request
+LIVEKIT_API_KEY = os.getenv('LIVEKIT_API_KEY')
+LIVEKIT_API_SECRET = os.getenv('LIVEKIT_API_SECRET')
+LIVEKIT_URL = os.getenv('LIVEKIT_URL')
+
+# Built once and copied into each response
+CORS_HEADERS = CIMultiDict({
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+})
+
 
 async def create_token(request):
     """
@@ -31,13 +45,13 @@ async def create_token(request):
     """
     try:
         data = await request.json()
-        identity = data.get('identity', f'user-{os.urandom(4).hex()}')
+        identity = data.get('identity', f'user-{secrets.token_hex(4)}')
         room_name = data.get('roomName', 'hadith-voice-room')
 
         # Create access token
         token = api.AccessToken(
-            api_key=os.getenv('LIVEKIT_API_KEY'),
-            api_secret=os.getenv('LIVEKIT_API_SECRET'),
+            api_key=LIVEKIT_API_KEY,
+            api_secret=LIVEKIT_API_SECRET,
         )
 
         token.with_identity(identity).with_name(identity).with_grants(
@@ -55,7 +69,7 @@ async def create_token(request):
 
         return web.json_response({
             'token': jwt_token,
-            'url': os.getenv('LIVEKIT_URL')
+            'url': LIVEKIT_URL
         })
 
     except Exception as e:
@@ -73,13 +87,7 @@ async def health_check(request):
 
 async def handle_options(request):
     """Handle CORS preflight requests"""
-    return web.Response(
-        headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type',
-        }
-    )
+    return web.Response(headers=CORS_HEADERS)
 
 
 @web.middleware
@@ -89,9 +97,7 @@ async def cors_middleware(request, handler):
         return await handle_options(request)
 
     response = await handler(request)
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'POST, GET, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers.update(CORS_HEADERS)
     return response
 
 
@@ -116,6 +122,13 @@ if __name__ == '__main__':
         logger.error("Please set them in your .env file")
         exit(1)
 
+    # uvloop is a faster drop-in event loop (not available on Windows)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        logger.info("uvloop not installed - using the default asyncio event loop")
+
     app = create_app()
 
     port = int(os.getenv('PORT', 8080))